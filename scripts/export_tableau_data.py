@@ -1,21 +1,26 @@
 """
 Export data for Tableau Dashboard visualization.
 
-This script creates optimized CSV exports from the SQLite database
-for use in Tableau Public.
+This script creates optimized Parquet (Snappy) exports from the SQLite
+database for use in Tableau. Pass --csv to also write CSV copies.
 
 Exports:
-1. orders_fact.csv - Main fact table with orders, payments, reviews
-2. product_sales.csv - Product sales with categories and seller info
-3. customer_segments.csv - Customer RFM segmentation data
-4. monthly_metrics.csv - Monthly summary metrics
+1. orders_fact - Main fact table with orders, payments, reviews
+2. product_sales - Product sales with categories and seller info
+3. customer_segments - Customer RFM segmentation data
+4. monthly_metrics - Monthly summary metrics
+5. seller_performance - Seller scorecard metrics
 
 Author: Steward Agent
 Date: 2026-02-04
 """
 
+import argparse
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from pathlib import Path
 
@@ -27,14 +32,288 @@ EXPORT_PATH = PROJECT_ROOT / 'data' / 'tableau_exports'
 # Ensure export directory exists
 EXPORT_PATH.mkdir(parents=True, exist_ok=True)
 
+EXPORT_NAMES = [
+    'orders_fact', 'product_sales', 'customer_segments',
+    'monthly_metrics', 'seller_performance'
+]
+
+# Read-side SQLite tuning: 256 MB page cache, memory-mapped I/O and
+# in-memory temp b-trees for the GROUP BY / ORDER BY work
+SQLITE_PRAGMAS = [
+    'PRAGMA cache_size=-262144',
+    'PRAGMA mmap_size=30000000000',
+    'PRAGMA temp_store=MEMORY'
+]
+
+# Timestamp columns parsed once by read_sql_query; names not present in a
+# query's result are ignored
+DATE_COLUMNS = [
+    'order_purchase_timestamp', 'order_approved_at',
+    'order_delivered_carrier_date', 'order_delivered_customer_date',
+    'order_estimated_delivery_date', 'review_creation_date',
+    'shipping_limit_date'
+]
+
+# Weekday names indexed by Series.dt.weekday (Monday=0)
+DAY_NAMES = np.array(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
+
+# Per-order review CTE shared by the export queries. Orders with several
+# reviews keep the lowest score and earliest review date; the GROUP BY runs
+# off the covering index from create_indexes()
+REVIEWS_PER_ORDER = '''r AS (
+        SELECT
+            order_id,
+            MIN(review_score) as review_score,
+            MIN(review_creation_date) as review_creation_date
+        FROM order_reviews
+        GROUP BY order_id
+    )'''
+
+# Rows per chunk for exports streamed straight to disk
+CHUNK_ROWS = 50_000
+
+# Timestamp format for streamed CSVs; left to pandas, a column whose
+# values in one chunk all fall on midnight would be written as bare dates
+CSV_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Low-cardinality strings stored as Parquet dictionary pages
+CATEGORY_COLUMNS = ['customer_state', 'order_status', 'primary_payment_type', 'segment']
+
+# Whole-number columns with known small ranges. All are nullable: most
+# come through LEFT JOINs, and SQLite allows NULL in any of the source
+# columns
+COLUMN_DTYPES = {
+    'order_year': 'Int16',
+    'order_item_id': 'Int16',
+    'customer_zip_code_prefix': 'Int32',
+    'seller_zip_code_prefix': 'Int32',
+    'payment_count': 'Int16',
+    'total_installments': 'Int16',
+    'review_score': 'Int8',
+    'product_photos_qty': 'Int8',
+    'product_weight_g': 'Int32'
+}
+
+
+def connect(db_path=DB_PATH):
+    """
+    Open a SQLite connection with the read-side PRAGMAs applied.
+    """
+    conn = sqlite3.connect(db_path)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 
-def export_orders_fact(conn):
+def run_with_connection(export_func, db_path, write_csv=False):
     """
-    Export main fact table: orders with payments, reviews, and customer info.
+    Run a connection-based exporter on its own connection.
+
+    Worker processes cannot share the parent's sqlite3 connection, so each
+    one opens a reader of its own (SQLite allows concurrent readers).
     """
-    print("Exporting orders_fact.csv...")
+    conn = connect(db_path)
+    try:
+        return export_func(conn, write_csv)
+    finally:
+        conn.close()
 
-    query = '''
+
+def create_indexes(conn):
+    """
+    Index the join keys used by the exports so SQLite can aggregate and join
+    per order without full table scans.
+    """
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_op_oid ON order_payments(order_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_or_cover ON order_reviews(order_id, review_score, review_creation_date)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_oi_oid ON order_items(order_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_oi_sid ON order_items(seller_id, order_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_o_oid ON orders(order_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_o_cid ON orders(customer_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_c_cid ON customers(customer_id)')
+    conn.commit()
+
+
+def month_key(timestamps):
+    """
+    Integer year * 100 + month key (e.g. 201805) for a datetime Series.
+
+    Returned as nullable Int32 so missing timestamps come back as <NA>.
+    """
+    return (timestamps.dt.year * 100 + timestamps.dt.month).astype('Int32')
+
+
+def month_label(keys):
+    """
+    Format month keys as 'YYYY-MM', building each distinct label only once.
+    Missing keys stay missing.
+    """
+    labels = {key: f'{key // 100}-{key % 100:02d}' for key in keys.dropna().unique()}
+    return keys.map(labels)
+
+
+def elapsed_days(start, end, mask):
+    """
+    Whole days from start to end (floored, like Timedelta.days) as Int32.
+
+    Computed on the full columns in one pass; rows outside mask or with a
+    missing timestamp come back as <NA>.
+    """
+    delta = end.to_numpy() - start.to_numpy()
+    missing = np.isnat(delta) | ~mask
+    days = np.where(missing, np.timedelta64(0, 'D'), delta) // np.timedelta64(1, 'D')
+    return pd.arrays.IntegerArray(days.astype(np.int32), missing)
+
+
+def quintile_score(values, ascending=True):
+    """
+    Score values 1-5 by quintile, using the same edges as pd.qcut(values, 5).
+
+    Higher values get higher scores unless ascending is False. Edges are
+    computed on the non-missing values only; NaN values score <NA>.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    edges = np.quantile(values[~missing], [0.2, 0.4, 0.6, 0.8])
+    bins = np.digitize(values, edges, right=True)
+    scores = np.where(missing, 0, bins + 1 if ascending else 5 - bins).astype(np.int8)
+    return pd.arrays.IntegerArray(scores, missing)
+
+
+def downcast_dtypes(df, downcast_integers=True):
+    """
+    Return a copy of df with the smallest dtypes that hold its values.
+
+    Integer columns are downcast losslessly. Float columns are left alone,
+    since float32 cannot hold the monetary values to the cent. Pass
+    downcast_integers=False to apply only the fixed COLUMN_DTYPES, e.g.
+    when every chunk of a stream has to end up with the same schema.
+    """
+    df = df.copy()
+    for col, dtype in COLUMN_DTYPES.items():
+        if col in df.columns:
+            df[col] = df[col].astype(dtype)
+    if downcast_integers:
+        for col in df.select_dtypes('integer').columns:
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def save_export(df, name, write_csv=False):
+    """
+    Write an export as Snappy-compressed Parquet, plus CSV when requested.
+    """
+    df = downcast_dtypes(df)
+    df.to_parquet(EXPORT_PATH / f'{name}.parquet', compression='snappy', engine='pyarrow', index=False)
+    if write_csv:
+        df.to_csv(EXPORT_PATH / f'{name}.csv', index=False)
+
+
+def build_delivered_base(conn):
+    """
+    Load delivered orders with customer, payment and review info, one row
+    per order. Shared by the customer segment and monthly metric exports.
+
+    customer_unique_id is factorized once into a Categorical, so every
+    groupby on it hashes int codes instead of 32-character strings.
+    """
+    query = f'''
+    WITH p AS (
+        SELECT order_id, SUM(payment_value) as payment_value
+        FROM order_payments
+        GROUP BY order_id
+    ),
+    {REVIEWS_PER_ORDER}
+    SELECT
+        o.order_id,
+        c.customer_unique_id,
+        o.order_purchase_timestamp,
+        o.order_delivered_customer_date,
+        o.order_estimated_delivery_date,
+        c.customer_city,
+        c.customer_state,
+        p.payment_value,
+        r.review_score
+    FROM orders o
+    JOIN customers c ON o.customer_id = c.customer_id
+    LEFT JOIN p ON o.order_id = p.order_id
+    LEFT JOIN r ON o.order_id = r.order_id
+    WHERE o.order_status = 'delivered'
+    '''
+    delivered = pd.read_sql_query(query, conn, parse_dates=DATE_COLUMNS)
+    delivered['customer_unique_id'] = pd.Categorical(delivered['customer_unique_id'])
+    return delivered
+
+
+def save_export_chunks(chunks, name, write_csv=False):
+    """
+    Stream DataFrame chunks into Snappy Parquet (plus CSV when requested),
+    holding one chunk in memory at a time. The first chunk fixes the
+    Parquet schema, so integers are not downcast by each chunk's own range.
+    Returns the number of rows written.
+    """
+    parquet_path = EXPORT_PATH / f'{name}.parquet'
+    csv_path = EXPORT_PATH / f'{name}.csv'
+    # Chunks go to .partial files that only replace the real exports once
+    # every chunk is written, so a failure never leaves a truncated table
+    partial_parquet = parquet_path.with_name(parquet_path.name + '.partial')
+    partial_csv = csv_path.with_name(csv_path.name + '.partial')
+    writer = None
+    row_count = 0
+    try:
+        for chunk in chunks:
+            chunk = downcast_dtypes(chunk, downcast_integers=False)
+            schema = writer.schema if writer is not None else None
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(partial_parquet, table.schema, compression='snappy')
+            writer.write_table(table)
+            if write_csv:
+                chunk.to_csv(
+                    partial_csv, mode='a' if row_count else 'w', header=not row_count,
+                    index=False, date_format=CSV_DATE_FORMAT
+                )
+            row_count += len(chunk)
+        if writer is not None:
+            writer.close()
+            writer = None
+            partial_parquet.replace(parquet_path)
+        if write_csv and row_count:
+            partial_csv.replace(csv_path)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        partial_parquet.unlink(missing_ok=True)
+        partial_csv.unlink(missing_ok=True)
+        raise
+    return row_count
+
+
+def export_orders_fact(conn, write_csv=False):
+    """
+    Export main fact table: orders with payments, reviews, and customer info.
+
+    Rows are streamed to disk in chunks; returns the number of orders written.
+    """
+    print("Exporting orders_fact...")
+
+    # Payments and reviews are aggregated per order inside SQLite so pandas
+    # only ever sees one row per order
+    query = f'''
+    WITH p AS (
+        SELECT
+            order_id,
+            SUM(payment_value) as total_payment_value,
+            MAX(payment_type) as primary_payment_type,
+            SUM(payment_installments) as total_installments,
+            COUNT(*) as payment_count
+        FROM order_payments
+        GROUP BY order_id
+    ),
+    {REVIEWS_PER_ORDER}
     SELECT
         o.order_id,
         o.customer_id,
@@ -47,89 +326,72 @@ def export_orders_fact(conn):
         o.order_estimated_delivery_date,
         c.customer_city,
         c.customer_state,
-        c.customer_zip_code_prefix
+        c.customer_zip_code_prefix,
+        p.total_payment_value,
+        p.primary_payment_type,
+        p.total_installments,
+        p.payment_count,
+        r.review_score,
+        r.review_creation_date
     FROM orders o
     LEFT JOIN customers c ON o.customer_id = c.customer_id
+    LEFT JOIN p ON o.order_id = p.order_id
+    LEFT JOIN r ON o.order_id = r.order_id
     '''
-    orders_df = pd.read_sql_query(query, conn)
-
-    # Get payments aggregated by order
-    payments_query = '''
-    SELECT
-        order_id,
-        SUM(payment_value) as total_payment_value,
-        MAX(payment_type) as primary_payment_type,
-        SUM(payment_installments) as total_installments,
-        COUNT(*) as payment_count
-    FROM order_payments
-    GROUP BY order_id
-    '''
-    payments_df = pd.read_sql_query(payments_query, conn)
-
-    # Get reviews (one per order)
-    reviews_query = '''
-    SELECT
-        order_id,
-        review_score,
-        review_creation_date
-    FROM order_reviews
-    '''
-    reviews_df = pd.read_sql_query(reviews_query, conn)
-    # Keep first review per order if duplicates exist
-    reviews_df = reviews_df.drop_duplicates(subset=['order_id'], keep='first')
-
-    # Merge all data
-    orders_fact = orders_df.merge(payments_df, on='order_id', how='left')
-    orders_fact = orders_fact.merge(reviews_df, on='order_id', how='left')
-
-    # Convert timestamps
-    date_cols = [
-        'order_purchase_timestamp', 'order_approved_at',
-        'order_delivered_carrier_date', 'order_delivered_customer_date',
-        'order_estimated_delivery_date', 'review_creation_date'
-    ]
-    for col in date_cols:
-        orders_fact[col] = pd.to_datetime(orders_fact[col], errors='coerce')
-
-    # Add calculated fields for Tableau
-    orders_fact['order_year'] = orders_fact['order_purchase_timestamp'].dt.year
-    orders_fact['order_month'] = orders_fact['order_purchase_timestamp'].dt.to_period('M').astype(str)
-    orders_fact['order_quarter'] = orders_fact['order_purchase_timestamp'].dt.to_period('Q').astype(str)
-    orders_fact['order_day_of_week'] = orders_fact['order_purchase_timestamp'].dt.day_name()
-
-    # Delivery time calculations (only for delivered orders)
-    delivered_mask = orders_fact['order_status'] == 'delivered'
-    orders_fact['actual_delivery_days'] = np.nan
-    orders_fact.loc[delivered_mask, 'actual_delivery_days'] = (
-        orders_fact.loc[delivered_mask, 'order_delivered_customer_date'] -
-        orders_fact.loc[delivered_mask, 'order_purchase_timestamp']
-    ).dt.days
-
-    orders_fact['estimated_delivery_days'] = np.nan
-    orders_fact.loc[delivered_mask, 'estimated_delivery_days'] = (
-        orders_fact.loc[delivered_mask, 'order_estimated_delivery_date'] -
-        orders_fact.loc[delivered_mask, 'order_purchase_timestamp']
-    ).dt.days
-
-    orders_fact['delivery_delay_days'] = (
-        orders_fact['actual_delivery_days'] - orders_fact['estimated_delivery_days']
-    )
-
-    orders_fact['on_time_delivery'] = (orders_fact['delivery_delay_days'] <= 0).map({True: 'On Time', False: 'Late'})
-    orders_fact.loc[~delivered_mask, 'on_time_delivery'] = None
+    chunks = pd.read_sql_query(query, conn, parse_dates=DATE_COLUMNS, chunksize=CHUNK_ROWS)
+
+    def add_calculated_fields(chunks):
+        for orders_fact in chunks:
+            # Add calculated fields for Tableau
+            orders_fact['order_year'] = orders_fact['order_purchase_timestamp'].dt.year
+            orders_fact['order_month'] = month_label(month_key(orders_fact['order_purchase_timestamp']))
+            quarter_key = (orders_fact['order_year'] * 10 + orders_fact['order_purchase_timestamp'].dt.quarter).astype('Int32')
+            orders_fact['order_quarter'] = quarter_key.map(
+                {key: f'{key // 10}Q{key % 10}' for key in quarter_key.dropna().unique()}
+            )
+            weekday = orders_fact['order_purchase_timestamp'].dt.weekday
+            orders_fact['order_day_of_week'] = np.where(
+                weekday.notna(), DAY_NAMES[weekday.fillna(0).to_numpy(dtype=np.intp)], None
+            )
+
+            # Delivery time calculations (only for delivered orders)
+            delivered_mask = (orders_fact['order_status'] == 'delivered').to_numpy()
+            orders_fact['actual_delivery_days'] = elapsed_days(
+                orders_fact['order_purchase_timestamp'], orders_fact['order_delivered_customer_date'], delivered_mask
+            )
+            orders_fact['estimated_delivery_days'] = elapsed_days(
+                orders_fact['order_purchase_timestamp'], orders_fact['order_estimated_delivery_date'], delivered_mask
+            )
+
+            orders_fact['delivery_delay_days'] = (
+                orders_fact['actual_delivery_days'] - orders_fact['estimated_delivery_days']
+            )
+
+            # A delivered order with no delivery date counts as late
+            on_time = (orders_fact['delivery_delay_days'] <= 0).to_numpy(dtype=bool, na_value=False)
+            orders_fact['on_time_delivery'] = np.where(
+                delivered_mask,
+                np.where(on_time, 'On Time', 'Late'),
+                None
+            )
+
+            yield orders_fact
 
     # Save
-    orders_fact.to_csv(EXPORT_PATH / 'orders_fact.csv', index=False)
-    print(f"  - Exported {len(orders_fact):,} orders")
+    row_count = save_export_chunks(add_calculated_fields(chunks), 'orders_fact', write_csv)
+    print(f"  - Exported {row_count:,} orders")
 
-    return orders_fact
+    return row_count
 
 
-def export_product_sales(conn):
+def export_product_sales(conn, write_csv=False):
     """
     Export product sales data with categories and seller information.
+
+    Rows are streamed to disk in chunks, so memory stays flat as the
+    order_items table grows. Returns the number of order items written.
     """
-    print("Exporting product_sales.csv...")
+    print("Exporting product_sales...")
 
     query = '''
     SELECT
@@ -149,186 +411,124 @@ def export_product_sales(conn):
         p.product_photos_qty,
         s.seller_city,
         s.seller_state,
-        s.seller_zip_code_prefix
+        s.seller_zip_code_prefix,
+        o.order_purchase_timestamp,
+        o.order_status
     FROM order_items oi
     LEFT JOIN products p ON oi.product_id = p.product_id
     LEFT JOIN product_category_translation t ON p.product_category_name = t.product_category_name
     LEFT JOIN sellers s ON oi.seller_id = s.seller_id
+    LEFT JOIN orders o ON oi.order_id = o.order_id
     '''
-    product_sales = pd.read_sql_query(query, conn)
+    chunks = pd.read_sql_query(query, conn, parse_dates=DATE_COLUMNS, chunksize=CHUNK_ROWS)
 
-    # Add order date for time-based analysis
-    order_dates_query = '''
-    SELECT order_id, order_purchase_timestamp, order_status
-    FROM orders
-    '''
-    order_dates = pd.read_sql_query(order_dates_query, conn)
-    product_sales = product_sales.merge(order_dates, on='order_id', how='left')
-
-    # Convert timestamps
-    product_sales['order_purchase_timestamp'] = pd.to_datetime(product_sales['order_purchase_timestamp'])
-    product_sales['shipping_limit_date'] = pd.to_datetime(product_sales['shipping_limit_date'])
+    def add_calculated_fields(chunks):
+        for product_sales in chunks:
+            # Add time dimensions
+            product_sales['order_month'] = month_label(month_key(product_sales['order_purchase_timestamp']))
+            product_sales['order_year'] = product_sales['order_purchase_timestamp'].dt.year
 
-    # Add time dimensions
-    product_sales['order_month'] = product_sales['order_purchase_timestamp'].dt.to_period('M').astype(str)
-    product_sales['order_year'] = product_sales['order_purchase_timestamp'].dt.year
+            # Calculate total item value
+            product_sales['total_item_value'] = product_sales['price'] + product_sales['freight_value']
 
-    # Calculate total item value
-    product_sales['total_item_value'] = product_sales['price'] + product_sales['freight_value']
+            # Fill missing category names
+            product_sales['product_category_name_english'] = product_sales['product_category_name_english'].fillna('Unknown')
 
-    # Fill missing category names
-    product_sales['product_category_name_english'] = product_sales['product_category_name_english'].fillna('Unknown')
+            yield product_sales
 
     # Save
-    product_sales.to_csv(EXPORT_PATH / 'product_sales.csv', index=False)
-    print(f"  - Exported {len(product_sales):,} order items")
+    row_count = save_export_chunks(add_calculated_fields(chunks), 'product_sales', write_csv)
+    print(f"  - Exported {row_count:,} order items")
 
-    return product_sales
+    return row_count
 
 
-def export_customer_segments(conn):
+def export_customer_segments(delivered, write_csv=False):
     """
     Create and export customer RFM segmentation data.
-    """
-    print("Exporting customer_segments.csv...")
 
-    # Get customer order history
-    query = '''
-    SELECT
-        c.customer_unique_id,
-        c.customer_city,
-        c.customer_state,
-        o.order_id,
-        o.order_purchase_timestamp,
-        o.order_status
-    FROM customers c
-    JOIN orders o ON c.customer_id = o.customer_id
-    WHERE o.order_status = 'delivered'
-    '''
-    customer_orders = pd.read_sql_query(query, conn)
-    customer_orders['order_purchase_timestamp'] = pd.to_datetime(customer_orders['order_purchase_timestamp'])
-
-    # Get payments per order
-    payments_query = '''
-    SELECT order_id, SUM(payment_value) as payment_value
-    FROM order_payments
-    GROUP BY order_id
-    '''
-    payments = pd.read_sql_query(payments_query, conn)
-    customer_orders = customer_orders.merge(payments, on='order_id', how='left')
+    Expects the delivered-orders table from build_delivered_base().
+    Returns the number of customers written.
+    """
+    print("Exporting customer_segments...")
 
     # Calculate RFM metrics
-    analysis_date = customer_orders['order_purchase_timestamp'].max() + pd.Timedelta(days=1)
-
-    rfm = customer_orders.groupby('customer_unique_id').agg({
-        'order_purchase_timestamp': lambda x: (analysis_date - x.max()).days,  # Recency
-        'order_id': 'count',  # Frequency
-        'payment_value': 'sum',  # Monetary
-        'customer_city': 'first',
-        'customer_state': 'first'
-    }).reset_index()
+    analysis_date = delivered['order_purchase_timestamp'].max() + pd.Timedelta(days=1)
+
+    # Only built-in reducers, so pandas runs the whole groupby in Cython;
+    # recency is derived from the last purchase date afterwards
+    rfm = delivered.groupby('customer_unique_id', observed=True).agg(
+        frequency=('order_id', 'count'),
+        monetary=('payment_value', 'sum'),
+        customer_city=('customer_city', 'first'),
+        customer_state=('customer_state', 'first'),
+        first_purchase_date=('order_purchase_timestamp', 'min'),
+        last_purchase_date=('order_purchase_timestamp', 'max')
+    ).reset_index()
+    rfm['customer_unique_id'] = rfm['customer_unique_id'].astype(str)
+    first_purchase_date = rfm.pop('first_purchase_date')
+    last_purchase_date = rfm.pop('last_purchase_date')
+    rfm.insert(1, 'recency', (analysis_date - last_purchase_date).dt.days)
+
+    # Calculate RFM scores (1-5); frequency is mostly 1, so it is ranked
+    # first (ties broken by order, like rank(method='first')) to get
+    # distinct quintile edges
+    frequency_rank = np.argsort(rfm['frequency'].to_numpy(), kind='stable').argsort() + 1
+    rfm['r_score'] = quintile_score(rfm['recency'].to_numpy(), ascending=False)
+    rfm['f_score'] = quintile_score(frequency_rank)
+    rfm['m_score'] = quintile_score(rfm['monetary'].to_numpy())
+
+    # Combine into a three-digit RFM code (e.g. 414)
+    rfm['rfm_score'] = (
+        rfm['r_score'].astype('Int16') * 100 +
+        rfm['f_score'].astype('Int16') * 10 +
+        rfm['m_score'].astype('Int16')
+    )
 
-    rfm.columns = ['customer_unique_id', 'recency', 'frequency', 'monetary', 'customer_city', 'customer_state']
-
-    # Calculate RFM scores (1-5)
-    rfm['r_score'] = pd.qcut(rfm['recency'], 5, labels=[5, 4, 3, 2, 1], duplicates='drop')
-    rfm['f_score'] = pd.qcut(rfm['frequency'].rank(method='first'), 5, labels=[1, 2, 3, 4, 5])
-    rfm['m_score'] = pd.qcut(rfm['monetary'], 5, labels=[1, 2, 3, 4, 5], duplicates='drop')
-
-    # Convert scores to int
-    rfm['r_score'] = rfm['r_score'].astype('Int64')
-    rfm['f_score'] = rfm['f_score'].astype('Int64')
-    rfm['m_score'] = rfm['m_score'].astype('Int64')
-
-    # Create RFM string
-    rfm['rfm_score'] = rfm['r_score'].astype(str) + rfm['f_score'].astype(str) + rfm['m_score'].astype(str)
-
-    # Segment customers
-    def segment_customer(row):
-        r, f = row['r_score'], row['f_score']
-        if pd.isna(r) or pd.isna(f):
-            return 'Unknown'
-        r, f = int(r), int(f)
-        if r >= 4 and f >= 4:
-            return 'Champions'
-        elif r >= 3 and f >= 3:
-            return 'Loyal Customers'
-        elif r >= 4 and f <= 2:
-            return 'New Customers'
-        elif r >= 3 and f <= 2:
-            return 'Potential Loyalists'
-        elif r <= 2 and f >= 3:
-            return 'At Risk'
-        elif r <= 2 and f <= 2:
-            return 'Hibernating'
-        else:
-            return 'Need Attention'
-
-    rfm['segment'] = rfm.apply(segment_customer, axis=1)
+    # Segment customers (conditions are checked in order, first match wins)
+    r = rfm['r_score'].to_numpy(dtype='float64', na_value=np.nan)
+    f = rfm['f_score'].to_numpy(dtype='float64', na_value=np.nan)
+    conditions = [
+        (r >= 4) & (f >= 4),
+        (r >= 3) & (f >= 3),
+        (r >= 4) & (f <= 2),
+        (r >= 3) & (f <= 2),
+        (r <= 2) & (f >= 3),
+        (r <= 2) & (f <= 2)
+    ]
+    choices = [
+        'Champions', 'Loyal Customers', 'New Customers',
+        'Potential Loyalists', 'At Risk', 'Hibernating'
+    ]
+    rfm['segment'] = np.select(conditions, choices, default='Need Attention')
+    rfm['segment'] = np.where(np.isnan(r) | np.isnan(f), 'Unknown', rfm['segment'])
 
     # Add first and last purchase dates
-    purchase_dates = customer_orders.groupby('customer_unique_id').agg({
-        'order_purchase_timestamp': ['min', 'max']
-    }).reset_index()
-    purchase_dates.columns = ['customer_unique_id', 'first_purchase_date', 'last_purchase_date']
-
-    rfm = rfm.merge(purchase_dates, on='customer_unique_id', how='left')
+    rfm['first_purchase_date'] = first_purchase_date
+    rfm['last_purchase_date'] = last_purchase_date
     rfm['customer_tenure_days'] = (rfm['last_purchase_date'] - rfm['first_purchase_date']).dt.days
 
     # Calculate average order value
     rfm['avg_order_value'] = rfm['monetary'] / rfm['frequency']
 
     # Save
-    rfm.to_csv(EXPORT_PATH / 'customer_segments.csv', index=False)
+    save_export(rfm, 'customer_segments', write_csv)
     print(f"  - Exported {len(rfm):,} customers with segments")
 
-    return rfm
+    return len(rfm)
 
 
-def export_monthly_metrics(conn):
+def export_monthly_metrics(delivered, write_csv=False):
     """
     Export monthly aggregated metrics for trend analysis.
-    """
-    print("Exporting monthly_metrics.csv...")
 
-    query = '''
-    SELECT
-        o.order_id,
-        o.customer_id,
-        c.customer_unique_id,
-        o.order_status,
-        o.order_purchase_timestamp,
-        o.order_delivered_customer_date,
-        o.order_estimated_delivery_date
-    FROM orders o
-    JOIN customers c ON o.customer_id = c.customer_id
-    '''
-    orders = pd.read_sql_query(query, conn)
-    orders['order_purchase_timestamp'] = pd.to_datetime(orders['order_purchase_timestamp'])
-    orders['order_month'] = orders['order_purchase_timestamp'].dt.to_period('M')
-
-    # Get payments
-    payments_query = '''
-    SELECT order_id, SUM(payment_value) as payment_value
-    FROM order_payments
-    GROUP BY order_id
-    '''
-    payments = pd.read_sql_query(payments_query, conn)
-    orders = orders.merge(payments, on='order_id', how='left')
-
-    # Get reviews
-    reviews_query = '''
-    SELECT order_id, review_score
-    FROM order_reviews
-    '''
-    reviews = pd.read_sql_query(reviews_query, conn)
-    reviews = reviews.drop_duplicates(subset=['order_id'], keep='first')
-    orders = orders.merge(reviews, on='order_id', how='left')
+    Expects the delivered-orders table from build_delivered_base().
+    Returns the number of months written.
+    """
+    print("Exporting monthly_metrics...")
 
-    # Filter to delivered orders for most metrics
-    delivered = orders[orders['order_status'] == 'delivered'].copy()
-    delivered['order_delivered_customer_date'] = pd.to_datetime(delivered['order_delivered_customer_date'])
-    delivered['order_estimated_delivery_date'] = pd.to_datetime(delivered['order_estimated_delivery_date'])
+    delivered = delivered.copy()
+    delivered['order_month'] = month_key(delivered['order_purchase_timestamp'])
 
     # Calculate on-time delivery
     delivered['delivery_days'] = (delivered['order_delivered_customer_date'] - delivered['order_purchase_timestamp']).dt.days
@@ -351,26 +551,27 @@ def export_monthly_metrics(conn):
         'avg_delivery_days', 'on_time_delivery_rate'
     ]
 
-    # Convert period to string for CSV
-    monthly['order_month'] = monthly['order_month'].astype(str)
-
     # Add date for proper time series in Tableau
-    monthly['month_date'] = pd.to_datetime(monthly['order_month'] + '-01')
+    monthly['month_date'] = pd.to_datetime(pd.DataFrame({
+        'year': monthly['order_month'] // 100,
+        'month': monthly['order_month'] % 100,
+        'day': 1
+    }))
 
     # Calculate new vs returning customers
     # First, find first purchase month for each customer
-    first_purchase = delivered.groupby('customer_unique_id')['order_month'].min().reset_index()
-    first_purchase.columns = ['customer_unique_id', 'first_purchase_month']
-    delivered = delivered.merge(first_purchase, on='customer_unique_id', how='left')
+    delivered['first_purchase_month'] = delivered.groupby('customer_unique_id', observed=True, sort=False)['order_month'].transform('min')
     delivered['is_new_customer'] = delivered['order_month'] == delivered['first_purchase_month']
 
     new_customers = delivered[delivered['is_new_customer']].groupby('order_month')['customer_unique_id'].nunique().reset_index()
     new_customers.columns = ['order_month', 'new_customers']
-    new_customers['order_month'] = new_customers['order_month'].astype(str)
 
     monthly = monthly.merge(new_customers, on='order_month', how='left')
     monthly['returning_customers'] = monthly['unique_customers'] - monthly['new_customers']
 
+    # Month keys become 'YYYY-MM' strings only for the export
+    monthly['order_month'] = month_label(monthly['order_month'])
+
     # Convert on-time rate to percentage
     monthly['on_time_delivery_rate'] = (monthly['on_time_delivery_rate'] * 100).round(2)
 
@@ -381,120 +582,119 @@ def export_monthly_metrics(conn):
     monthly['total_revenue'] = monthly['total_revenue'].round(2)
 
     # Save
-    monthly.to_csv(EXPORT_PATH / 'monthly_metrics.csv', index=False)
+    save_export(monthly, 'monthly_metrics', write_csv)
     print(f"  - Exported {len(monthly):,} months of metrics")
 
-    return monthly
+    return len(monthly)
 
 
-def export_seller_performance(conn):
+def export_seller_performance(conn, write_csv=False):
     """
     Export seller performance metrics for seller scorecard.
-    """
-    print("Exporting seller_performance.csv...")
 
-    query = '''
+    Returns the number of sellers written.
+    """
+    print("Exporting seller_performance...")
+
+    # One row per (seller, order) is built first so multi-item orders count
+    # once towards review and delivery averages, then everything is rolled
+    # up per seller in the same query. Reviews cover all of a seller's
+    # orders; revenue and delivery metrics only delivered ones.
+    # The composite score and rank are window functions over the rollup,
+    # so the whole scorecard comes out of SQLite ready to save.
+    query = f'''
+    WITH {REVIEWS_PER_ORDER},
+    so AS (
+        SELECT
+            oi.seller_id,
+            oi.order_id,
+            o.order_status = 'delivered' as is_delivered,
+            SUM(oi.price) as price,
+            SUM(oi.freight_value) as freight_value,
+            JULIANDAY(o.order_delivered_customer_date) - JULIANDAY(o.order_purchase_timestamp) as delivery_days,
+            JULIANDAY(o.order_estimated_delivery_date) - JULIANDAY(o.order_purchase_timestamp) as estimated_days
+        FROM order_items oi
+        JOIN orders o ON oi.order_id = o.order_id
+        GROUP BY oi.seller_id, oi.order_id
+    ),
+    sp AS (
+        SELECT
+            s.seller_id,
+            SUM(so.is_delivered) as total_orders,
+            SUM(CASE WHEN so.is_delivered THEN so.price END) as total_revenue,
+            SUM(CASE WHEN so.is_delivered THEN so.freight_value END) as total_freight,
+            s.seller_city,
+            s.seller_state,
+            AVG(r.review_score) as avg_review_score,
+            COUNT(r.review_score) as review_count,
+            AVG(CASE WHEN so.is_delivered AND so.estimated_days IS NOT NULL
+                THEN so.delivery_days <= so.estimated_days END) as on_time_rate,
+            AVG(CASE WHEN so.is_delivered AND so.estimated_days IS NOT NULL
+                THEN so.delivery_days END) as avg_delivery_days
+        FROM sellers s
+        JOIN so ON s.seller_id = so.seller_id
+        LEFT JOIN r ON so.order_id = r.order_id
+        GROUP BY s.seller_id
+        HAVING SUM(so.is_delivered) > 0
+    ),
+    -- Normalize each metric to 0-100 scale
+    normalized AS (
+        SELECT
+            sp.*,
+            (total_revenue - MIN(total_revenue) OVER ()) /
+                (MAX(total_revenue) OVER () - MIN(total_revenue) OVER ()) * 100 as revenue_score,
+            avg_review_score / 5 * 100 as review_score_normalized,
+            on_time_rate * 100 as delivery_score
+        FROM sp
+    ),
+    -- Composite score: weighted average
+    scored AS (
+        SELECT
+            normalized.*,
+            ROUND(revenue_score * 0.3 + review_score_normalized * 0.4 + delivery_score * 0.3, 2) as composite_score
+        FROM normalized
+    )
     SELECT
-        s.seller_id,
-        s.seller_city,
-        s.seller_state,
-        oi.order_id,
-        oi.price,
-        oi.freight_value
-    FROM sellers s
-    JOIN order_items oi ON s.seller_id = oi.seller_id
-    JOIN orders o ON oi.order_id = o.order_id
-    WHERE o.order_status = 'delivered'
+        seller_id,
+        total_orders,
+        ROUND(total_revenue, 2) as total_revenue,
+        ROUND(total_freight, 2) as total_freight,
+        seller_city,
+        seller_state,
+        avg_review_score,
+        review_count,
+        on_time_rate * 100 as on_time_rate,
+        ROUND(avg_delivery_days, 1) as avg_delivery_days,
+        revenue_score,
+        review_score_normalized,
+        delivery_score,
+        composite_score,
+        CASE WHEN composite_score IS NOT NULL
+            THEN RANK() OVER (ORDER BY composite_score DESC) END as seller_rank
+    FROM scored
+    ORDER BY seller_id
     '''
-    seller_items = pd.read_sql_query(query, conn)
+    seller_performance = pd.read_sql_query(query, conn)
+    seller_performance['seller_rank'] = seller_performance['seller_rank'].astype('Int64')
 
-    # Get reviews per order
-    reviews_query = '''
-    SELECT oi.seller_id, r.order_id, r.review_score
-    FROM order_reviews r
-    JOIN order_items oi ON r.order_id = oi.order_id
-    '''
-    reviews = pd.read_sql_query(reviews_query, conn)
-    reviews = reviews.drop_duplicates(subset=['order_id', 'seller_id'], keep='first')
-
-    # Get delivery performance
-    delivery_query = '''
-    SELECT
-        oi.seller_id,
-        oi.order_id,
-        JULIANDAY(o.order_delivered_customer_date) - JULIANDAY(o.order_purchase_timestamp) as delivery_days,
-        JULIANDAY(o.order_estimated_delivery_date) - JULIANDAY(o.order_purchase_timestamp) as estimated_days
-    FROM order_items oi
-    JOIN orders o ON oi.order_id = o.order_id
-    WHERE o.order_status = 'delivered'
-        AND o.order_delivered_customer_date IS NOT NULL
-        AND o.order_estimated_delivery_date IS NOT NULL
-    '''
-    delivery = pd.read_sql_query(delivery_query, conn)
-    delivery['is_on_time'] = delivery['delivery_days'] <= delivery['estimated_days']
-    delivery = delivery.drop_duplicates(subset=['order_id', 'seller_id'], keep='first')
-
-    # Aggregate seller metrics
-    seller_revenue = seller_items.groupby('seller_id').agg({
-        'order_id': 'nunique',
-        'price': 'sum',
-        'freight_value': 'sum',
-        'seller_city': 'first',
-        'seller_state': 'first'
-    }).reset_index()
-    seller_revenue.columns = ['seller_id', 'total_orders', 'total_revenue', 'total_freight', 'seller_city', 'seller_state']
-
-    # Add review scores
-    seller_reviews = reviews.groupby('seller_id').agg({
-        'review_score': ['mean', 'count']
-    }).reset_index()
-    seller_reviews.columns = ['seller_id', 'avg_review_score', 'review_count']
-
-    # Add delivery performance
-    seller_delivery = delivery.groupby('seller_id').agg({
-        'is_on_time': 'mean',
-        'delivery_days': 'mean'
-    }).reset_index()
-    seller_delivery.columns = ['seller_id', 'on_time_rate', 'avg_delivery_days']
-
-    # Merge all
-    seller_performance = seller_revenue.merge(seller_reviews, on='seller_id', how='left')
-    seller_performance = seller_performance.merge(seller_delivery, on='seller_id', how='left')
-
-    # Calculate composite score (normalized)
-    # Normalize each metric to 0-100 scale
-    seller_performance['revenue_score'] = (
-        (seller_performance['total_revenue'] - seller_performance['total_revenue'].min()) /
-        (seller_performance['total_revenue'].max() - seller_performance['total_revenue'].min()) * 100
-    )
-    seller_performance['review_score_normalized'] = seller_performance['avg_review_score'] / 5 * 100
-    seller_performance['delivery_score'] = seller_performance['on_time_rate'] * 100
-
-    # Composite score: weighted average
-    seller_performance['composite_score'] = (
-        seller_performance['revenue_score'] * 0.3 +
-        seller_performance['review_score_normalized'] * 0.4 +
-        seller_performance['delivery_score'] * 0.3
-    ).round(2)
-
-    # Round metrics
+    # Round averages in pandas: SQLite's ROUND() takes exact halves away
+    # from zero, which would change published values
     seller_performance['avg_review_score'] = seller_performance['avg_review_score'].round(2)
-    seller_performance['on_time_rate'] = (seller_performance['on_time_rate'] * 100).round(2)
-    seller_performance['avg_delivery_days'] = seller_performance['avg_delivery_days'].round(1)
-    seller_performance['total_revenue'] = seller_performance['total_revenue'].round(2)
-
-    # Rank sellers
-    seller_performance['seller_rank'] = seller_performance['composite_score'].rank(ascending=False, method='min').astype('Int64')
+    seller_performance['on_time_rate'] = seller_performance['on_time_rate'].round(2)
 
     # Save
-    seller_performance.to_csv(EXPORT_PATH / 'seller_performance.csv', index=False)
+    save_export(seller_performance, 'seller_performance', write_csv)
     print(f"  - Exported {len(seller_performance):,} sellers")
 
-    return seller_performance
+    return len(seller_performance)
 
 
 def main():
     """Main export function."""
+    parser = argparse.ArgumentParser(description='Export data for Tableau Dashboard visualization.')
+    parser.add_argument('--csv', action='store_true', help='also write CSV copies of each export')
+    args = parser.parse_args()
+
     print("=" * 60)
     print("TABLEAU DATA EXPORT")
     print("=" * 60)
@@ -502,49 +702,66 @@ def main():
     print(f"Export path: {EXPORT_PATH}\n")
 
     # Connect to database
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect()
 
     try:
-        # Export all datasets
-        orders_fact = export_orders_fact(conn)
-        product_sales = export_product_sales(conn)
-        customer_segments = export_customer_segments(conn)
-        monthly_metrics = export_monthly_metrics(conn)
-        seller_performance = export_seller_performance(conn)
-
-        print("\n" + "=" * 60)
-        print("EXPORT COMPLETE")
-        print("=" * 60)
-        print(f"\nFiles exported to: {EXPORT_PATH}")
-        print("\nFiles created:")
-        print("  - orders_fact.csv")
-        print("  - product_sales.csv")
-        print("  - customer_segments.csv")
-        print("  - monthly_metrics.csv")
-        print("  - seller_performance.csv")
-
-        # Print summary statistics
-        print("\n" + "=" * 60)
-        print("SUMMARY STATISTICS")
-        print("=" * 60)
-        print(f"\nOrders: {len(orders_fact):,}")
-        print(f"Product sales (line items): {len(product_sales):,}")
-        print(f"Customers with segments: {len(customer_segments):,}")
-        print(f"Months of data: {len(monthly_metrics):,}")
-        print(f"Sellers: {len(seller_performance):,}")
-
-        # Key metrics
-        print("\nKey Metrics:")
-        delivered = orders_fact[orders_fact['order_status'] == 'delivered']
-        print(f"  - Total Revenue: R$ {delivered['total_payment_value'].sum():,.2f}")
-        print(f"  - Delivered Orders: {len(delivered):,}")
-        print(f"  - Unique Customers: {orders_fact['customer_unique_id'].nunique():,}")
-        print(f"  - Avg Order Value: R$ {delivered['total_payment_value'].mean():,.2f}")
-        print(f"  - Avg Review Score: {delivered['review_score'].mean():.2f}")
-
+        create_indexes(conn)
+
+        # Delivered orders are loaded once for the exports that need them
+        delivered = build_delivered_base(conn)
+
+        # orders_fact is streamed to disk, so the all-orders figure for the
+        # summary comes straight from SQLite
+        unique_customers = conn.execute('''
+            SELECT COUNT(DISTINCT c.customer_unique_id)
+            FROM orders o
+            LEFT JOIN customers c ON o.customer_id = c.customer_id
+        ''').fetchone()[0]
     finally:
         conn.close()
 
+    # The exports are independent, so each runs in its own process
+    db_path = str(DB_PATH)
+    with ProcessPoolExecutor(max_workers=len(EXPORT_NAMES)) as executor:
+        futures = [
+            executor.submit(run_with_connection, export_orders_fact, db_path, args.csv),
+            executor.submit(run_with_connection, export_product_sales, db_path, args.csv),
+            executor.submit(export_customer_segments, delivered, args.csv),
+            executor.submit(export_monthly_metrics, delivered, args.csv),
+            executor.submit(run_with_connection, export_seller_performance, db_path, args.csv)
+        ]
+        orders_fact_rows, product_sales_rows, customer_segment_rows, monthly_metric_rows, seller_rows = [
+            future.result() for future in futures
+        ]
+
+    print("\n" + "=" * 60)
+    print("EXPORT COMPLETE")
+    print("=" * 60)
+    print(f"\nFiles exported to: {EXPORT_PATH}")
+    print("\nFiles created:")
+    extensions = ['parquet', 'csv'] if args.csv else ['parquet']
+    for name in EXPORT_NAMES:
+        for ext in extensions:
+            print(f"  - {name}.{ext}")
+
+    # Print summary statistics
+    print("\n" + "=" * 60)
+    print("SUMMARY STATISTICS")
+    print("=" * 60)
+    print(f"\nOrders: {orders_fact_rows:,}")
+    print(f"Product sales (line items): {product_sales_rows:,}")
+    print(f"Customers with segments: {customer_segment_rows:,}")
+    print(f"Months of data: {monthly_metric_rows:,}")
+    print(f"Sellers: {seller_rows:,}")
+
+    # Key metrics
+    print("\nKey Metrics:")
+    print(f"  - Total Revenue: R$ {delivered['payment_value'].sum():,.2f}")
+    print(f"  - Delivered Orders: {len(delivered):,}")
+    print(f"  - Unique Customers: {unique_customers:,}")
+    print(f"  - Avg Order Value: R$ {delivered['payment_value'].mean():,.2f}")
+    print(f"  - Avg Review Score: {delivered['review_score'].mean():.2f}")
+
     print("\n" + "=" * 60)
 
 